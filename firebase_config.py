@@ -2,9 +2,27 @@ import os
 import firebase_admin
 from firebase_admin import credentials, firestore
 import json # Import json module to parse string content
+import asyncio
+import functools
+import threading
+import time
 
 # Initialize Firebase Admin SDK
-db = None # Initialize db as None
+# Only the app (credentials) is set up at import time. The Firestore client is created
+# lazily by get_db(), and a background thread warms it up (see the end of this module)
+# so the bot's startup doesn't wait on the first gRPC handshake.
+# Note: firestore.client() already opens a keepalive gRPC channel that multiplexes
+# concurrent reads over HTTP/2, so the worker-thread reads in get_content_async()
+# share it without contending. The background warm-up pays the channel setup cost.
+firebase_ready = False # True once the Firebase app has been initialized
+
+
+def _init_firebase_app(cred) -> None:
+    """Initializes the default Firebase app once."""
+    if not firebase_admin._apps: # Guard against double init (e.g. module imported twice)
+        firebase_admin.initialize_app(cred)
+
+
 try:
     # --- Try to initialize from environment variable (preferred for cloud deployment) ---
     firebase_config_json_str = os.getenv("FIREBASE_SERVICE_ACCOUNT_CONFIG")
@@ -12,8 +30,8 @@ try:
         try:
             cred_dict = json.loads(firebase_config_json_str)
             cred = credentials.Certificate(cred_dict)
-            firebase_admin.initialize_app(cred)
-            db = firestore.client()
+            _init_firebase_app(cred)
+            firebase_ready = True
             print("Firebase Admin SDK initialized successfully from environment variable (JSON string).")
         except json.JSONDecodeError as e:
             print(f"Error decoding Firebase service account JSON from FIREBASE_SERVICE_ACCOUNT_CONFIG: {e}")
@@ -21,7 +39,7 @@ try:
             # Continue to the file path method below if decoding fails
 
     # --- Fallback: Initialize from a file path (for local or Render's Secret Files) ---
-    if db is None: # Only try file path if not already initialized from JSON string
+    if not firebase_ready: # Only try file path if not already initialized from JSON string
         cred_path = os.getenv("FIREBASE_SERVICE_ACCOUNT_KEY_PATH")
         if not cred_path:
             print("FIREBASE_SERVICE_ACCOUNT_KEY_PATH environment variable not set. Cannot initialize Firebase from file path.")
@@ -33,8 +51,8 @@ try:
 
             if os.path.exists(full_cred_path):
                 cred = credentials.Certificate(full_cred_path)
-                firebase_admin.initialize_app(cred)
-                db = firestore.client()
+                _init_firebase_app(cred)
+                firebase_ready = True
                 print("Firebase Admin SDK initialized successfully from file path.")
             else:
                 print(f"Firebase service account file not found at: {full_cred_path}")
@@ -42,15 +60,90 @@ try:
 
 except Exception as e:
     print(f"Generic error initializing Firebase Admin SDK: {e}")
-    db = None # Ensure db is None if any error occurs
+    firebase_ready = False # Ensure no client is created if any error occurs
 
-# Check again if db is still None after all attempts
-if db is None:
+# Check again if Firebase is still not initialized after all attempts
+if not firebase_ready:
     print("Warning: Firestore DB client could not be initialized. Database operations will fail.")
 
 
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db():
+    """Returns the shared Firestore client, creating it on first use (None if Firebase isn't initialized)."""
+    global _db
+    if _db is not None or not firebase_ready:
+        return _db
+    with _db_lock:
+        if _db is None:
+            try:
+                _db = firestore.client()
+            except Exception as e:
+                print(f"Error creating Firestore client: {e}")
+    return _db
+
+
+def _log_background_write_error(description: str, task: asyncio.Task) -> None:
+    """Done-callback for background writes: logs failures instead of dropping them."""
+    if not task.cancelled() and task.exception():
+        print(f"Error saving {description}: {task.exception()}")
+
+
+def write_in_background(application, description: str, write, *args) -> asyncio.Task:
+    """Runs a blocking Firestore write (e.g. ref.set, batch.commit) in a worker thread
+    as an application task, so handlers can reply without waiting on Firestore."""
+    task = application.create_task(asyncio.to_thread(write, *args))
+    task.add_done_callback(functools.partial(_log_background_write_error, description))
+    return task
+
+
+# --- In-process content cache ---
+# Tips and quizzes barely change, so keep fetched documents in RAM for a while
+# instead of hitting Firestore on every user message.
+_CACHE_TTL = 300 # Seconds a cached document stays fresh
+_STATIC_CACHE_TTL = 3600 # Longer TTL for collections that are effectively static
+_STATIC_COLLECTIONS = {"digital_safety_content", "quizzes"}
+_CACHE_MAX_ENTRIES = 256 # Oldest entries are evicted beyond this size
+_content_cache: dict[tuple[str, str], tuple[float, dict]] = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_ttl(collection_name: str) -> int:
+    """Returns how long documents from a collection may be served from the cache."""
+    return _STATIC_CACHE_TTL if collection_name in _STATIC_COLLECTIONS else _CACHE_TTL
+
+
+def _get_fresh_cached(collection_name: str, document_id: str):
+    """Returns cached document data if it is still fresh, otherwise None."""
+    entry = _content_cache.get((collection_name, document_id))
+    if entry and time.monotonic() - entry[0] < _cache_ttl(collection_name):
+        return entry[1]
+    return None
+
+
+def _store_cached(key: tuple[str, str], data: dict) -> None:
+    """Stores document data in the cache, evicting the least recently stored entries."""
+    with _cache_lock:
+        _content_cache.pop(key, None) # Re-insert so dict order tracks recency
+        _content_cache[key] = (time.monotonic(), data)
+        while len(_content_cache) > _CACHE_MAX_ENTRIES:
+            _content_cache.pop(next(iter(_content_cache)))
+
+
 def get_content(collection_name: str, document_id: str):
-    """Fetches a document from a specified Firestore collection (synchronous)."""
+    """Fetches a document from a specified Firestore collection (synchronous).
+
+    Recently fetched documents are served from an in-process TTL cache; in that
+    case no document reference is returned (only the data).
+    """
+    key = (collection_name, document_id)
+    cached = _get_fresh_cached(collection_name, document_id)
+    if cached is not None:
+        return None, cached
+
+    db = get_db()
     if db is None:
         print("Firestore DB is not initialized. Cannot fetch content.")
         return None, None
@@ -59,10 +152,75 @@ def get_content(collection_name: str, document_id: str):
         doc_ref = db.collection(collection_name).document(document_id)
         doc = doc_ref.get() # Synchronous call
         if doc.exists:
-            return doc_ref, doc.to_dict()
+            data = doc.to_dict()
+            _store_cached(key, data)
+            return doc_ref, data
         else:
             print(f"Document {document_id} not found in collection {collection_name}.")
             return doc_ref, None
     except Exception as e:
         print(f"Error fetching document {document_id} from {collection_name}: {e}")
-        return None, None
\ No newline at end of file
+        return None, None
+
+
+async def get_content_async(collection_name: str, document_id: str):
+    """Async version of get_content for handlers: the blocking Firestore read runs in a
+    worker thread so the event loop keeps serving other users. Cache hits return directly."""
+    cached = _get_fresh_cached(collection_name, document_id)
+    if cached is not None:
+        return None, cached
+    return await asyncio.to_thread(get_content, collection_name, document_id)
+
+
+# --- Preloaded static content ---
+# The whole "digital_safety_content" collection is only a handful of tip documents,
+# so it is loaded once at startup (in the background) and kept current by a Firestore
+# snapshot listener.
+CONTENT_COLLECTION = "digital_safety_content"
+CONTENT: dict[str, dict] = {}
+
+
+def _on_content_snapshot(col_snapshot, changes, read_time):
+    """Firestore listener callback: applies live changes to CONTENT (runs on a Firestore thread)."""
+    for change in changes:
+        if change.type.name == "REMOVED":
+            CONTENT.pop(change.document.id, None)
+        else:
+            CONTENT[change.document.id] = change.document.to_dict()
+
+
+def peek_cached(document_id: str):
+    """Returns a digital_safety_content document only if it is already in memory, otherwise None."""
+    data = CONTENT.get(document_id)
+    if data is None:
+        data = _get_fresh_cached(CONTENT_COLLECTION, document_id)
+    return data
+
+
+async def get_cached(document_id: str):
+    """Returns a preloaded digital_safety_content document, falling back to Firestore if missing."""
+    data = CONTENT.get(document_id)
+    if data is None:
+        _, data = await get_content_async(CONTENT_COLLECTION, document_id)
+    return data
+
+
+def _warm_up() -> None:
+    """Creates the Firestore client and preloads CONTENT in the background, then keeps it live."""
+    global _content_watch
+    db = get_db()
+    if db is None:
+        return
+    try:
+        for snap in db.collection(CONTENT_COLLECTION).stream():
+            CONTENT[snap.id] = snap.to_dict()
+        print(f"Preloaded {len(CONTENT)} documents from {CONTENT_COLLECTION}.")
+        _content_watch = db.collection(CONTENT_COLLECTION).on_snapshot(_on_content_snapshot)
+    except Exception as e:
+        print(f"Error preloading {CONTENT_COLLECTION}: {e}")
+
+
+# Until the warm-up finishes, get_cached() simply falls back to regular fetches.
+_content_watch = None
+if firebase_ready:
+    threading.Thread(target=_warm_up, name="firestore-warm-up", daemon=True).start()
@@ -1,64 +1,90 @@
+import re
 from telegram import Update
 from telegram.constants import ChatAction
 from telegram.ext import ContextTypes
-from firebase_config import get_content, db  # Import db for writing to Firestore
+from firebase_admin import firestore
+from firebase_config import get_cached, peek_cached, get_db, write_in_background  # get_db for writing to Firestore
 
 # --- NEW: Separate handlers for each keyword ---
 
+# Specific privacy topics: field in the privacy_tips document -> (keywords, reply prefix).
+# Checked in order, so more specific topics must come before broader ones.
+TOPIC_MAP = {
+    "facebook_tips": (("privacy facebook",), "Here are some specific privacy tips for Facebook: 📱\n\n"),
+    "instagram_tips": (("privacy instagram",), "Here are some specific privacy tips for Instagram: 📸\n\n"),
+    "whatsapp_tips": (("privacy whatsapp",), "Here are some specific privacy tips for WhatsApp: 💬\n\n"),
+    "password_tips": (("privacy passwords", "strong passwords", "password tips"), "Here are some tips for creating strong, unique passwords: 🔐\n\n"),
+    "app_permission_tips": (("privacy app permissions", "app permissions"), "Here's what you need to know about app permissions: ⚙️\n\n"),
+}
+GENERAL_PRIVACY_FIELD = "tips"  # 'tips' is the general privacy field, matched by plain 'privacy'
+
+# Fixed reply text around the tips from Firestore, built once instead of per message
+GENERAL_PRIVACY_PREFIX = "Great! Let's talk about privacy. 🛡️ Here are some general tips:\n\n"
+GENERAL_PRIVACY_SUFFIX = (
+    "\n\nFor more specific advice, try asking about a platform like 'privacy facebook', 'privacy instagram', or 'privacy whatsapp'. "
+    "You can also ask about 'privacy passwords' or 'privacy app permissions'."
+)
+FAKE_PROFILE_PREFIX = "Spotting fake profiles is key! Here are some things to look for: 🕵️‍♀️\n\n"
+SCAM_PREFIX = "Scams are tricky. Here's what you need to know: 🚨\n\n"
+
+# One precompiled, case-insensitive regex with a named group per field, so a message is
+# scanned once (without a lowercased copy) instead of once per keyword.
+# When several topics appear, TOPIC_MAP order decides; general privacy comes last.
+_TOPIC_PRIORITY = {field: i for i, field in enumerate([*TOPIC_MAP, GENERAL_PRIVACY_FIELD])}
+_PRIVACY_RE = re.compile(
+    "|".join(
+        f"(?P<{field}>{'|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))})"
+        for field, (keywords, _) in TOPIC_MAP.items()
+    ) + f"|(?P<{GENERAL_PRIVACY_FIELD}>privacy)",
+    re.IGNORECASE,
+)
+
+def _match_topic(text: str) -> str | None:
+    """Returns the privacy_tips field for the highest-priority topic mentioned in the text, or None."""
+    hits = [m.lastgroup for m in _PRIVACY_RE.finditer(text)]
+    if not hits:
+        return None
+    return min(hits, key=_TOPIC_PRIORITY.__getitem__)
+
+async def _get_tips(update: Update, context: ContextTypes.DEFAULT_TYPE, document_id: str):
+    """Returns a tips document, showing 'typing...' only when it has to be fetched from Firestore."""
+    tips_info = peek_cached(document_id)
+    if tips_info is None:
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+        tips_info = await get_cached(document_id)
+    return tips_info
+
+FACEBOOK_FALLBACK_TEXT = (
+    "I couldn’t find specific Facebook privacy tips right now. 😔 "
+    "General tips: Review your privacy settings, limit who can see your posts, "
+    "and avoid sharing personal info publicly. Try again later for more details!"
+)
+
 async def handle_privacy_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles requests for privacy tips."""
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-    text_lower = update.message.text.lower()
-    
     response_text = "Sorry, I couldn't find detailed privacy tips right now. Please try again later. 😔"
+    privacy_info = await _get_tips(update, context, "privacy_tips") or {}
 
-    # Handle Specific Privacy Topics
-    if "privacy facebook" in text_lower:
-        _, privacy_info = get_content("digital_safety_content", "privacy_tips")
-        if privacy_info and "facebook_tips" in privacy_info:
-            response_text = f"Here are some specific privacy tips for Facebook: 📱\n\n{privacy_info['facebook_tips']}"
-        else:
-            response_text = (
-                "I couldn’t find specific Facebook privacy tips right now. 😔 "
-                "General tips: Review your privacy settings, limit who can see your posts, "
-                "and avoid sharing personal info publicly. Try again later for more details!"
-            )
-    elif "privacy instagram" in text_lower:
-        _, privacy_info = get_content("digital_safety_content", "privacy_tips")
-        if privacy_info and "instagram_tips" in privacy_info:
-            response_text = f"Here are some specific privacy tips for Instagram: 📸\n\n{privacy_info['instagram_tips']}"
-    elif "privacy whatsapp" in text_lower:
-        _, privacy_info = get_content("digital_safety_content", "privacy_tips")
-        if privacy_info and "whatsapp_tips" in privacy_info:
-            response_text = f"Here are some specific privacy tips for WhatsApp: 💬\n\n{privacy_info['whatsapp_tips']}"
-    elif "privacy passwords" in text_lower or "strong passwords" in text_lower or "password tips" in text_lower:
-        _, privacy_info = get_content("digital_safety_content", "privacy_tips")
-        if privacy_info and "password_tips" in privacy_info:
-            response_text = f"Here are some tips for creating strong, unique passwords: 🔐\n\n{privacy_info['password_tips']}"
-    elif "privacy app permissions" in text_lower or "app permissions" in text_lower:
-        _, privacy_info = get_content("digital_safety_content", "privacy_tips")
-        if privacy_info and "app_permission_tips" in privacy_info:
-            response_text = f"Here's what you need to know about app permissions: ⚙️\n\n{privacy_info['app_permission_tips']}"
+    field = _match_topic(update.message.text)
     # Fallback to general privacy tips if no specific platform/topic is mentioned
-    elif "privacy" in text_lower or "privacy tips" in text_lower:  # This catches the general 'privacy'
-        _, privacy_info = get_content("digital_safety_content", "privacy_tips")
-        if privacy_info and "tips" in privacy_info:  # 'tips' is your general privacy field
-            response_text = (
-                f"Great! Let's talk about privacy. 🛡️ Here are some general tips:\n\n{privacy_info['tips']}\n\n"
-                "For more specific advice, try asking about a platform like 'privacy facebook', 'privacy instagram', or 'privacy whatsapp'. "
-                "You can also ask about 'privacy passwords' or 'privacy app permissions'."
-            )
+    if field == GENERAL_PRIVACY_FIELD:
+        if field in privacy_info:
+            response_text = GENERAL_PRIVACY_PREFIX + str(privacy_info[field]) + GENERAL_PRIVACY_SUFFIX
+    # Handle Specific Privacy Topics
+    elif field:
+        if field in privacy_info:
+            response_text = TOPIC_MAP[field][1] + str(privacy_info[field])
+        elif field == "facebook_tips":
+            response_text = FACEBOOK_FALLBACK_TEXT
     
     await update.message.reply_text(response_text)
 
 async def handle_fake_profile_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles requests for fake profile tips."""
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-    
-    _, fake_profile_info = get_content("digital_safety_content", "fake_profile_tips")
+    fake_profile_info = await _get_tips(update, context, "fake_profile_tips")
     if fake_profile_info:
         tips = fake_profile_info.get("tips", "No fake profile tips found.")
-        response_text = f"Spotting fake profiles is key! Here are some things to look for: 🕵️‍♀️\n\n{tips}"
+        response_text = FAKE_PROFILE_PREFIX + str(tips)
     else:
         response_text = "Sorry, I couldn't find detailed fake profile tips right now. 😔"
     
@@ -66,17 +92,24 @@ async def handle_fake_profile_request(update: Update, context: ContextTypes.DEFA
 
 async def handle_scam_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles requests for scam prevention tips."""
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-
-    _, scam_info = get_content("digital_safety_content", "scam_tips")
+    scam_info = await _get_tips(update, context, "scam_tips")
     if scam_info:
         tips = scam_info.get("tips", "No scam tips found.")
-        response_text = f"Scams are tricky. Here's what you need to know: 🚨\n\n{tips}"
+        response_text = SCAM_PREFIX + str(tips)
     else:
         response_text = "Sorry, I couldn't find detailed scam prevention tips right now. 😔"
     
     await update.message.reply_text(response_text)
 
+REPORT_HELP_TEXT = (
+    "To report a fake profile, use the /report command followed by the username (e.g., /report @username).\n"
+    "Your report will be reviewed, and appropriate action will be taken if it's confirmed as fake.\n"
+    "Tips to spot fake profiles:\n"
+    "- Check for verification badges.\n"
+    "- Look for unusual usernames or low activity.\n"
+    "For urgent issues, you can also report directly to Telegram via @notoscam."
+)
+
 async def report_fake_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles reporting of fake profiles."""
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
@@ -93,19 +126,20 @@ async def report_fake_profile(update: Update, context: ContextTypes.DEFAULT_TYPE
     reported_username = args[0]  # First argument is the username
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    report_time = update.message.date.strftime("%Y-%m-%d %H:%M:%S")
 
     # Store the report in Firestore
     report_data = {
         "reported_by": user_id,
         "chat_id": chat_id,
         "reported_username": reported_username,
-        "report_time": report_time,
+        "report_time": firestore.SERVER_TIMESTAMP,  # Set by Firestore on write
         "status": "pending"
     }
     try:
-        report_ref = db.collection("fake_profile_reports").document(str(user_id) + "_" + report_time.replace(" ", "_"))
-        report_ref.set(report_data)
+        # Auto-generated ID: no collisions when a user reports twice in the same second
+        report_ref = get_db().collection("fake_profile_reports").document()
+        # Write in the background so the user gets the confirmation without waiting on Firestore
+        write_in_background(context.application, "fake profile report", report_ref.set, report_data)
         await update.message.reply_text(
             f"Thank you! The profile {reported_username} has been reported for review. We'll investigate and take action if needed. 😊"
         )
@@ -116,14 +150,6 @@ async def report_fake_profile(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def report_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Provides help on how to use the /report command."""
-    help_text = (
-        "To report a fake profile, use the /report command followed by the username (e.g., /report @username).\n"
-        "Your report will be reviewed, and appropriate action will be taken if it's confirmed as fake.\n"
-        "Tips to spot fake profiles:\n"
-        "- Check for verification badges.\n"
-        "- Look for unusual usernames or low activity.\n"
-        "For urgent issues, you can also report directly to Telegram via @notoscam."
-    )
-    await update.message.reply_text(help_text)
+    await update.message.reply_text(REPORT_HELP_TEXT)
 
 # --- END NEW ---
\ No newline at end of file
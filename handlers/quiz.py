@@ -2,7 +2,9 @@ import random
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ChatAction
 from telegram.ext import ContextTypes
-from firebase_config import get_content # Ensure this import path is correct
+from telegram.helpers import escape_markdown
+from firebase_admin import firestore
+from firebase_config import get_content_async, get_db, write_in_background # Ensure this import path is correct
 
 # Constants for quiz state management
 QUIZ_STATE = "QUIZ_STATE"
@@ -10,6 +12,7 @@ CURRENT_QUESTION_INDEX = "CURRENT_QUESTION_INDEX"
 CORRECT_ANSWERS_COUNT = "CORRECT_ANSWERS_COUNT"
 QUIZ_DATA = "QUIZ_DATA"
 QUIZ_TOPIC = "QUIZ_TOPIC"
+QUIZ_EVENTS = "QUIZ_EVENTS" # Answers given so far, written to Firestore in one batch at the end
 
 async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a message with inline buttons for quiz topics."""
@@ -22,6 +25,17 @@ async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Choose a quiz topic:", reply_markup=reply_markup)
 
+def _build_keyboard(quiz_id: str, question: dict) -> InlineKeyboardMarkup:
+    """Builds the answer buttons for a quiz question."""
+    options = question["options"]
+    keyboard = []
+    # Ensure options are always sorted by key (A, B, C, D) for consistent display
+    for key in sorted(options.keys()):
+        # Callback data format: quiz_topic_prefix|question_id|selected_option
+        callback_data = f"{quiz_id}|{question['question_id']}|{key}"
+        keyboard.append([InlineKeyboardButton(f"{key}. {options[key]}", callback_data=callback_data)])
+    return InlineKeyboardMarkup(keyboard)
+
 async def _send_question(update: Update, context: ContextTypes.DEFAULT_TYPE, quiz_id: str) -> None:
     """Sends the current quiz question to the user."""
     user_data = context.user_data
@@ -35,17 +49,9 @@ async def _send_question(update: Update, context: ContextTypes.DEFAULT_TYPE, qui
 
     question = quiz_data["questions"][current_index]
     question_text = question["question_text"]
-    options = question["options"]
-
-    keyboard = []
-    # Ensure options are always sorted by key (A, B, C, D) for consistent display
-    sorted_options_keys = sorted(options.keys())
-    for key in sorted_options_keys:
-        # Callback data format: quiz_topic_prefix|question_id|selected_option
-        callback_data = f"{quiz_id}|{question['question_id']}|{key}"
-        keyboard.append([InlineKeyboardButton(f"{key}. {options[key]}", callback_data=callback_data)])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Keyboard is prebuilt when the quiz is loaded; build it here only as a fallback
+    reply_markup = question.get("_keyboard") or _build_keyboard(quiz_id, question)
 
     # Determine if we should edit the previous message or send a new one
     # This is important for smooth UX, avoiding multiple messages for each question
@@ -74,6 +80,26 @@ async def _send_question(update: Update, context: ContextTypes.DEFAULT_TYPE, qui
         )
 
 
+def _save_quiz_result(update: Update, context: ContextTypes.DEFAULT_TYPE, correct_count: int, total_questions: int) -> None:
+    """Writes the finished quiz's answers and score to Firestore in a single batched commit (in the background)."""
+    events = context.user_data.get(QUIZ_EVENTS)
+    db = get_db()
+    if db is None or not events:
+        return
+    try:
+        batch = db.batch()
+        batch.set(db.collection("quiz_results").document(), {
+            "user_id": update.effective_user.id,
+            "quiz_topic": context.user_data.get(QUIZ_TOPIC),
+            "events": events,
+            "score": correct_count,
+            "total_questions": total_questions,
+            "finished_at": firestore.SERVER_TIMESTAMP,
+        })
+        write_in_background(context.application, "quiz result", batch.commit)
+    except Exception as e:
+        print(f"Error saving quiz result: {e}")
+
 async def _end_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Ends the quiz and displays the final score."""
     user_data = context.user_data
@@ -96,12 +122,15 @@ async def _end_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Great job! Would you like to try another quiz or learn more with /help?"
     )
 
+    _save_quiz_result(update, context, correct_count, total_questions)
+
     # Clear user data for the quiz
     user_data.pop(QUIZ_STATE, None)
     user_data.pop(CURRENT_QUESTION_INDEX, None)
     user_data.pop(CORRECT_ANSWERS_COUNT, None)
     user_data.pop(QUIZ_DATA, None)
     user_data.pop(QUIZ_TOPIC, None)
+    user_data.pop(QUIZ_EVENTS, None)
 
     # Send the final message, preferably by replying to the last message or sending a new one
     if update.callback_query and update.callback_query.message:
@@ -128,14 +157,22 @@ async def quiz_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
         user_data[CURRENT_QUESTION_INDEX] = 0
         user_data[CORRECT_ANSWERS_COUNT] = 0
         user_data[QUIZ_TOPIC] = quiz_topic_prefix # Store the topic for context (e.g., "fake_profile")
+        user_data[QUIZ_EVENTS] = []
 
         try:
-            # Get quiz data from Firestore (synchronous call as before)
-            _, quiz_doc = get_content("quizzes", quiz_doc_id)
+            # Get quiz data from Firestore (off the event loop, or from the cache)
+            _, quiz_doc = await get_content_async("quizzes", quiz_doc_id)
 
             if quiz_doc and "questions" in quiz_doc and len(quiz_doc["questions"]) > 0:
                 # Shuffle questions to make each quiz fresh and assign to user_data
-                quiz_doc["questions"] = random.sample(quiz_doc["questions"], len(quiz_doc["questions"]))
+                # (shuffle copies: the cached document is shared between users).
+                # Answer keyboards are built once here instead of on every send.
+                questions = [
+                    {**question, "_keyboard": _build_keyboard(quiz_topic_prefix, question)}
+                    for question in quiz_doc["questions"]
+                ]
+                random.shuffle(questions)
+                quiz_doc = {**quiz_doc, "questions": questions}
                 user_data[QUIZ_DATA] = quiz_doc
 
                 # Get title for the starting message, defaulting to a friendly name
@@ -192,6 +229,8 @@ async def quiz_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
     # Validate that the answer is for the expected question (based on question_id)
     if current_question["question_id"] == question_id:
         is_correct = (selected_option == current_question["correct_answer"])
+        # Record the answer in memory; everything is written once when the quiz ends
+        user_data.setdefault(QUIZ_EVENTS, []).append({"q": question_id, "a": selected_option, "ok": is_correct})
         if is_correct:
             correct_count += 1
             user_data[CORRECT_ANSWERS_COUNT] = correct_count
@@ -204,8 +243,8 @@ async def quiz_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
 
         # Append feedback to the question message and remove buttons
         try:
-            # Telegram Bot API's MarkdownV2 requires escaping specific characters if they are literal
-            escaped_feedback = feedback_message.replace('_', '\\_').replace('*', '\\*').replace('[', '\\[')
+            # Telegram Bot API's MarkdownV2 requires escaping all reserved characters if they are literal
+            escaped_feedback = escape_markdown(feedback_message, version=2)
             await query.edit_message_text(
                 text=f"{query.message.text_markdown_v2}\n\n{escaped_feedback}",
                 reply_markup=None, # Remove buttons after answer
@@ -2,44 +2,103 @@ from telegram import Update
 from telegram.constants import ChatAction
 from telegram.ext import ContextTypes
 from gtts import gTTS
-import os
+import asyncio
+import io
+from firebase_config import get_content_async, get_db, write_in_background
+
+# Everything after the personal greeting is the same for every user, so its voice
+# note is synthesized once and the mp3 bytes are reused for every /start.
+_STATIC_BODY = (
+    "I'm your Digital Self-Defense Chatbot. I can help you learn about:\n"
+    "🛡️ Privacy Controls\n"
+    "👹 Identifying Fake Profiles\n"
+    "🚫 Avoiding Scams\n\n"
+    "To get started, simply type 'privacy', 'fake profile', or 'scam'. You can also send me a suspicious link to scan! 🔎\n"
+    "Type /help to see more options!"
+)
+_STATIC_MP3: bytes | None = None
+
+HELP_TEXT = (
+    "Here are the things I can help you with:\n"
+    "- Type 'privacy' or 'privacy tips' to learn about setting privacy controls.\n"
+    "- Type 'fake profile' to get tips on identifying suspicious accounts.\n"
+    "- Type 'scam' or 'scams' to understand common scams and how to avoid them.\n"
+    "- Type /quiz to test your knowledge with interactive quizzes! 🧠\n"
+    "- Type /start to see the welcome message again."
+)
+
+# Once uploaded, Telegram lets us resend the voice note by its file_id, so later
+# /start calls send a short string instead of the audio. The id is kept in
+# Firestore (bot_state/welcome_voice) so it survives restarts.
+_WELCOME_FILE_ID: str | None = None
+_WELCOME_STATE_DOC = ("bot_state", "welcome_voice")
+
+def _synthesize(text: str) -> bytes:
+    """Converts text to mp3 bytes in memory (blocking network call to gTTS)."""
+    buf = io.BytesIO()
+    gTTS(text=text, lang='en').write_to_fp(buf)
+    return buf.getvalue()
+
+async def _get_static_mp3() -> bytes:
+    """Returns the welcome voice note audio, generating it with gTTS on first use."""
+    global _STATIC_MP3
+    if _STATIC_MP3 is None:
+        # gTTS blocks on HTTP, so run it in a worker thread to keep the event loop free
+        _STATIC_MP3 = await asyncio.to_thread(_synthesize, _STATIC_BODY)
+    return _STATIC_MP3
+
+async def _get_welcome_file_id() -> str | None:
+    """Returns the stored file_id of the uploaded welcome voice note, if any."""
+    global _WELCOME_FILE_ID
+    if _WELCOME_FILE_ID is None:
+        _, state = await get_content_async(*_WELCOME_STATE_DOC)
+        if state:
+            _WELCOME_FILE_ID = state.get("file_id")
+    return _WELCOME_FILE_ID
+
+def _save_welcome_file_id(context: ContextTypes.DEFAULT_TYPE, file_id: str) -> None:
+    """Remembers the welcome voice note file_id in memory and in Firestore (in the background)."""
+    global _WELCOME_FILE_ID
+    _WELCOME_FILE_ID = file_id
+    db = get_db()
+    if db is None:
+        return
+    try:
+        state_ref = db.collection(_WELCOME_STATE_DOC[0]).document(_WELCOME_STATE_DOC[1])
+        write_in_background(context.application, "welcome voice file_id", state_ref.set, {"file_id": file_id})
+    except Exception as e:
+        print(f"Error saving welcome voice file_id: {e}")
+
+async def _send_welcome_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends the welcome voice note, reusing the uploaded file when possible."""
+    global _WELCOME_FILE_ID
+    file_id = await _get_welcome_file_id()
+    if file_id:
+        try:
+            await update.effective_chat.send_voice(voice=file_id)
+            return
+        except Exception as e:
+            # e.g. the id belongs to another bot token - upload the audio again
+            print(f"Error sending welcome voice by file_id: {e}. Uploading it again.")
+            _WELCOME_FILE_ID = None
+
+    audio = await _get_static_mp3()
+    sent = await update.effective_chat.send_voice(voice=io.BytesIO(audio), filename='welcome.mp3') # Changed to send_voice for better compatibility
+    if sent and sent.voice:
+        _save_welcome_file_id(context, sent.voice.file_id)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message with a voice note."""
     user = update.effective_user
-    welcome_message = (
-        f"Hello {user.first_name} ❤️!\n"
-        "I'm your Digital Self-Defense Chatbot. I can help you learn about:\n"
-        "🛡️ Privacy Controls\n"
-        "👹 Identifying Fake Profiles\n"
-        "🚫 Avoiding Scams\n\n"
-        "To get started, simply type 'privacy', 'fake profile', or 'scam'. You can also send me a suspicious link to scan! 🔎\n"
-        "Type /help to see more options!"
-    )
-
-    # Convert welcome message to speech
-    tts = gTTS(text=welcome_message, lang='en')
-    audio_file = 'welcome_message.mp3'
-    tts.save(audio_file)
+    welcome_message = f"Hello {user.first_name} ❤️!\n" + _STATIC_BODY
 
     # Send the text message first
     await update.message.reply_text(welcome_message)
 
     # Show 'sending audio...' status while uploading
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.UPLOAD_VOICE)
-    await update.effective_chat.send_voice(voice=open(audio_file, 'rb')) # Changed to send_voice for better compatibility
-
-    # Clean up the generated audio file
-    os.remove(audio_file)
+    await _send_welcome_voice(update, context)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a message with available commands and topics."""
-    help_text = (
-        "Here are the things I can help you with:\n"
-        "- Type 'privacy' or 'privacy tips' to learn about setting privacy controls.\n"
-        "- Type 'fake profile' to get tips on identifying suspicious accounts.\n"
-        "- Type 'scam' or 'scams' to understand common scams and how to avoid them.\n"
-        "- Type /quiz to test your knowledge with interactive quizzes! 🧠\n"
-        "- Type /start to see the welcome message again."
-    )
-    await update.message.reply_text(help_text)
\ No newline at end of file
+    await update.message.reply_text(HELP_TEXT)
\ No newline at end of file
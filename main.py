@@ -1,3 +1,4 @@
+import asyncio
 import os
 import re  # Make sure 're' is imported for regex filters
 from telegram import Update, MessageEntity
@@ -14,7 +15,7 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Import Firebase setup and functions from firebase_config.py
-from firebase_config import db  # This 'db' is the initialized Firestore client
+from firebase_config import firebase_ready  # The Firestore client itself is created by the background warm-up
 from firebase_config import get_content
 
 # Import handlers
@@ -23,11 +24,61 @@ from handlers.quiz import quiz_command, quiz_callback_handler
 from handlers.digital_safety import handle_privacy_request, handle_fake_profile_request, handle_scam_request, report_fake_profile, report_help
 
 # Import security scanners
-from security_scanners import scan_url
+from security_scanners import scan_url, close_http_client
+
+# All text keywords and backslash commands in one precompiled pattern, so each message
+# is matched once; handle_keyword_message dispatches on the group that matched.
+KEYWORD_RE = re.compile(r'^(?:(privacy(?: tips)?)|(fake profiles?)|(scams?)|\\(start|help|quiz))$', re.IGNORECASE)
+BACKSLASH_COMMANDS = {"start": start_command, "help": help_command, "quiz": quiz_command}
+
+async def handle_keyword_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Routes a keyword or backslash-command message matched by KEYWORD_RE to its handler."""
+    match = context.matches[0]
+    if match.group(1):
+        await handle_privacy_request(update, context)
+    elif match.group(2):
+        await handle_fake_profile_request(update, context)
+    elif match.group(3):
+        await handle_scam_request(update, context)
+    else:
+        await BACKSLASH_COMMANDS[match.group(4).lower()](update, context)
+
+async def _run_scan_and_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, ack: asyncio.Task) -> None:
+    """Scans a URL and replies with the verdict; runs as a background task.
+
+    A per-chat semaphore keeps verdicts in the order the links were sent in that chat,
+    while scans from different chats run concurrently. The verdict is only sent once the
+    "Scanning..." acknowledgement (sent concurrently with the scan) has gone out.
+    Each chat's entry is dropped again once none of its scans are running or queued.
+    """
+    chat_id = update.effective_chat.id
+    chat_sems = context.bot_data.setdefault("chat_sems", {})  # chat_id -> [semaphore, scans using it]
+    entry = chat_sems.setdefault(chat_id, [asyncio.Semaphore(1), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            scan_result = await scan_url(url)
+            await asyncio.wait([ack])  # Don't overtake the ack; its errors are reported by its own task
+            await update.message.reply_text(scan_result, parse_mode='Markdown')
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del chat_sems[chat_id]
+
+# Cheap pre-check before walking message entities: every link Telegram marks as a URL
+# (including bare ones like 'example.com') has a dot between word characters.
+URL_HINT_RE = re.compile(r'\w\.\w')
+
+# The bot only handles messages and button presses; don't have Telegram send anything else
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
 # Define PORT for webhook and check for RENDER_EXTERNAL_HOSTNAME
 PORT = int(os.environ.get('PORT', 8000))  # Default to 8000 for local testing if PORT not set
 
+async def _post_shutdown(application: Application) -> None:
+    """Releases shared resources when the bot stops."""
+    await close_http_client()
+
 def main():
     """Start the bot."""
     token = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -35,12 +86,12 @@ def main():
         print("Error: TELEGRAM_BOT_TOKEN not found in environment variables.")
         return
 
-    if db is None:
+    if not firebase_ready:
         print("Exiting: Firebase DB failed to initialize. Bot cannot operate.")
         return
 
     try:
-        application = Application.builder().token(token).build()
+        application = Application.builder().token(token).post_shutdown(_post_shutdown).build()
 
         # Register command handlers
         application.add_handler(CommandHandler("start", start_command))
@@ -49,10 +100,8 @@ def main():
         application.add_handler(CommandHandler("report", report_fake_profile))  # New report command
         application.add_handler(CommandHandler("report_help", report_help))     # New help command
 
-        # Add MessageHandlers for backslash commands
-        application.add_handler(MessageHandler(filters.Regex(r'(?i)^\\start$'), start_command))
-        application.add_handler(MessageHandler(filters.Regex(r'(?i)^\\help$'), help_command))
-        application.add_handler(MessageHandler(filters.Regex(r'(?i)^\\quiz$'), quiz_command))
+        # Single MessageHandler for text keywords ('privacy', 'fake profile', 'scam') and backslash commands
+        application.add_handler(MessageHandler(filters.Regex(KEYWORD_RE), handle_keyword_message))
 
         # Register callback query handler for quiz buttons
         application.add_handler(CallbackQueryHandler(quiz_callback_handler))
@@ -60,36 +109,31 @@ def main():
         # Handler for scanning URLs
         async def handle_url_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             if update.message and update.message.text and update.message.entities:
-                for entity in update.message.entities:
-                    if entity.type == MessageEntity.URL:
-                        url = update.message.text[entity.offset : entity.offset + entity.length]
-                        await update.message.reply_text("🔎 Scanning URL... Please wait. This might take a few seconds.")
-                        scan_result = await scan_url(url)
-                        await update.message.reply_text(scan_result, parse_mode='Markdown')
-                        return
-        application.add_handler(MessageHandler(filters.TEXT & filters.Entity(MessageEntity.URL), handle_url_message))
-
-        # Re-adding specific handlers for text keywords
-        application.add_handler(MessageHandler(filters.Regex(r'(?i)^(privacy|privacy tips)$'), handle_privacy_request))
-        application.add_handler(MessageHandler(filters.Regex(r'(?i)^(fake profile|fake profiles)$'), handle_fake_profile_request))
-        application.add_handler(MessageHandler(filters.Regex(r'(?i)^(scam|scams)$'), handle_scam_request))
+                # Only the first URL in the message is scanned
+                entity = next((e for e in update.message.entities if e.type == MessageEntity.URL), None)
+                if entity is None:
+                    return
+                url = update.message.parse_entity(entity)
+                if not url.lower().startswith(('http://', 'https://')):
+                    url = 'http://' + url  # Telegram also detects bare 'example.com' links; the scanners need a scheme
+                # Send the acknowledgement and start scanning at the same time, both in the
+                # background so a slow scan doesn't hold up other updates
+                ack = context.application.create_task(
+                    update.message.reply_text("🔎 Scanning URL... Please wait. This might take a few seconds."), update=update
+                )
+                context.application.create_task(_run_scan_and_reply(update, context, url, ack), update=update)
+        application.add_handler(MessageHandler(filters.TEXT & filters.Regex(URL_HINT_RE) & filters.Entity(MessageEntity.URL), handle_url_message))
 
         # Fallback handler for all messages
+        # (the filter below only lets text, voice and photo messages through)
         async def unhandled_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             if update.message:
-                if update.message.voice:
-                    await update.message.reply_text("I'm not sure how to respond to that yet. Try typing 'privacy', 'fake profile', or 'scam', or use /help for commands.")
-                elif update.message.photo:
-                    await update.message.reply_text("I'm not sure how to respond to that yet. Try typing 'privacy', 'fake profile', or 'scam', or use /help for commands.")
-                elif update.message.text:
-                    await update.message.reply_text("I'm not sure how to respond to that yet. Try typing 'privacy', 'fake profile', or 'scam', or use /help for commands.")
+                await update.message.reply_text("I'm not sure how to respond to that yet. Try typing 'privacy', 'fake profile', or 'scam', or use /help for commands.")
 
         application.add_handler(MessageHandler(
             ~filters.COMMAND & 
             ~filters.Entity(MessageEntity.URL) & 
-            ~filters.Regex(r'(?i)^(privacy|privacy tips)$') & 
-            ~filters.Regex(r'(?i)^(fake profile|fake profiles)$') & 
-            ~filters.Regex(r'(?i)^(scam|scams)$') & 
+            ~filters.Regex(KEYWORD_RE) & 
             (filters.TEXT | filters.VOICE | filters.PHOTO), 
             unhandled_message
         ))
@@ -104,11 +148,13 @@ def main():
                 listen="0.0.0.0",
                 port=PORT,
                 url_path=token,
-                webhook_url=f"https://{WEBHOOK_URL}/{token}"
+                webhook_url=f"https://{WEBHOOK_URL}/{token}",
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=True
             )
         else:
             print("Running bot locally with long polling... Press Ctrl+C to stop.")
-            application.run_polling(allowed_updates=Update.ALL_TYPES)
+            application.run_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
 
     except telegram.error.NetworkError as e:
         logger.error(f"Network error occurred: {e}. Check your internet connection or DNS settings.")
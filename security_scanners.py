@@ -1,17 +1,153 @@
 import os
 import httpx
+import orjson
 import base64
+import hashlib
+import time
 import asyncio
-import urllib.parse
+import functools
+import random
+from enum import IntEnum
+
+class Verdict(IntEnum):
+    """Outcome of a scan; scanners return (Verdict, message) and scan_url decides on the enum."""
+    DANGER = 0 # Includes VT results with only suspicious detections
+    SAFE = 2
+    INCONCLUSIVE = 3
+    ERROR = 4
+    PENDING = 5 # Analysis started but not finished yet
 
 # --- Google Safe Browsing API Constants ---
 GOOGLE_SAFE_BROWSING_API_URL = "https://safebrowsing.googleapis.com/v4/threatMatches:find"
 
+# API keys are read once at import (main.py loads .env before importing this module)
+_GSB_API_KEY = os.getenv("GOOGLE_SAFE_BROWSE_API_KEY")
+_GSB_URL_WITH_KEY = f"{GOOGLE_SAFE_BROWSING_API_URL}?key={_GSB_API_KEY}" if _GSB_API_KEY else None
+
+# Request bodies are serialized with orjson, so the content type is set explicitly
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Static part of every Safe Browsing lookup request
+_GSB_PAYLOAD_TEMPLATE = {
+    "client": {
+        "clientId": "your-digital-safety-bot",
+        "clientVersion": "1.0.0"
+    },
+    "threatInfo": {
+        "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"],
+        "platformTypes": ["ANY_PLATFORM"],
+        "threatEntryTypes": ["URL"]
+    }
+}
+
+# User-facing messages for failed GSB requests, by HTTP status ({status}/{detail} are filled in)
+_GSB_HTTP_ERRORS = {
+    400: "❌ **Invalid URL for GSB!** Check the link format. (Details: `{detail}`)",
+    403: "❌ **Access Denied (Google Safe Browsing)!** Check your API key or daily quota. (Details: `{detail}`)",
+    404: "❌ Error: Invalid API endpoint or URL. Check the Safe Browsing API configuration.",
+}
+_GSB_HTTP_ERROR_DEFAULT = (
+    "❌ An issue occurred with Google Safe Browsing scan (HTTP Error {status}). "
+    "Please try again later. (Details: `{detail}`...)"
+)
+
 # --- VirusTotal API Constants ---
 VIRUSTOTAL_API_BASE_URL = "https://www.virustotal.com/api/v3"
 VIRUSTOTAL_GUI_BASE_URL = "https://www.virustotal.com/gui/url/"
 
+_VT_API_KEY = os.getenv("VIRUSTOTAL_API_KEY")
+_VT_HEADERS = {
+    "x-apikey": _VT_API_KEY,
+    "Accept": "application/json"
+}
+
+# User-facing messages for failed VT requests, by HTTP status ({status}/{detail} are filled in)
+_VT_HTTP_ERRORS = {
+    401: "❌ **API Key Error (VT)!** Check your VirusTotal API key.",
+    403: "❌ **Access Denied (VT)!** VirusTotal quota exceeded.",
+}
+_VT_HTTP_ERROR_DEFAULT = "❌ VT scanning issue (HTTP Error {status}). Try again. (Details: `{detail}`...)"
+
+def _vt_http_error(response: httpx.Response) -> tuple[Verdict, str]:
+    """Builds the error verdict for a failed VirusTotal response."""
+    message = _VT_HTTP_ERRORS.get(response.status_code, _VT_HTTP_ERROR_DEFAULT)
+    return Verdict.ERROR, message.format(status=response.status_code, detail=response.text[:150])
+
+# --- VirusTotal analysis polling ---
+VT_POLL_DEADLINE = 20.0 # Max seconds spent polling for a new analysis; kept inside SCAN_DEADLINE
+VT_POLL_INITIAL_DELAY = 2.0
+VT_POLL_BACKOFF = 1.6 # Delay multiplier after each poll
+VT_POLL_MAX_DELAY = 10.0
+VT_POLL_JITTER = 0.5 # Random extra delay so concurrent scans don't poll in lockstep
+# The submit for a new analysis starts this long after the existing-report lookup, so
+# for URLs VT already knows it is usually cancelled before it is sent (saving quota)
+VT_SUBMIT_DELAY = 0.5
+
+def _retry_after_seconds(response: httpx.Response) -> float | None:
+    """Returns the Retry-After header value in seconds, if present and numeric."""
+    value = response.headers.get("retry-after")
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None # HTTP-date form; fall back to the normal backoff
+
+# --- Shared HTTP client ---
+# One client for all scans keeps TCP/TLS connections to both APIs alive between
+# requests (and multiplexes them over HTTP/2) instead of reconnecting on every scan.
+GSB_TIMEOUT = 10.0
+VT_TIMEOUT = 45.0
+_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(VT_TIMEOUT, connect=5.0, pool=5.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+)
+
+async def close_http_client() -> None:
+    """Stops the GSB batching worker and closes the shared HTTP client (call on application shutdown)."""
+    if _gsb_worker is not None:
+        _gsb_worker.cancel()
+    await _CLIENT.aclose()
+
+# --- Overall scan limits ---
+# Bounds how long one scan can pin a task and how many scans run at once;
+# past SCAN_MAX_WAITERS queued scans, new ones are rejected instead of queued.
+SCAN_DEADLINE = 30.0
+SCAN_CONCURRENCY = 32
+SCAN_MAX_WAITERS = 64
+SCAN_TIMEOUT_MESSAGE = "ℹ️ Scan took too long — please retry later."
+SCAN_BUSY_MESSAGE = "ℹ️ The scanner is busy right now — please retry in a minute."
+_SCAN_SEM = asyncio.Semaphore(SCAN_CONCURRENCY)
+_scan_waiters = 0
+
+# --- Scan verdict cache ---
+# Popular links get posted again and again; remember recent verdicts so repeats are
+# answered instantly without spending API quota. Errors and unfinished scans are only
+# kept briefly so an outage isn't hammered but a retry soon gets a fresh result.
+_VERDICT_TTL = 900
+_TRANSIENT_VERDICT_TTL = 60
+_VERDICT_CACHE_MAX_ENTRIES = 10_000
+_verdict_cache: dict[bytes, tuple[float, str]] = {} # key -> (expiry time, message)
+# Scans still running, so the same link arriving in several chats at once is scanned only once
+_inflight_scans: dict[bytes, asyncio.Task] = {}
+
+def _verdict_key(url: str) -> bytes:
+    return hashlib.blake2b(url.encode(), digest_size=16).digest()
+
+def _get_cached_verdict(key: bytes) -> str | None:
+    entry = _verdict_cache.get(key)
+    if entry and time.monotonic() < entry[0]:
+        return entry[1]
+    return None
+
+def _store_verdict(key: bytes, verdict: Verdict, message: str) -> None:
+    ttl = _TRANSIENT_VERDICT_TTL if verdict in (Verdict.ERROR, Verdict.PENDING) else _VERDICT_TTL
+    _verdict_cache.pop(key, None) # Re-insert so dict order tracks recency
+    _verdict_cache[key] = (time.monotonic() + ttl, message)
+    while len(_verdict_cache) > _VERDICT_CACHE_MAX_ENTRIES:
+        _verdict_cache.pop(next(iter(_verdict_cache)))
+
 # Helper function for VirusTotal URL ID (for API and GUI links)
+@functools.lru_cache(maxsize=4096)
 def get_vt_url_id(url: str) -> str:
     # VirusTotal GUI often uses base64url(url) without padding.
     # This is also commonly used as the 'id' for direct URL lookups in their API v3.
@@ -21,258 +157,385 @@ async def scan_url(url: str) -> str:
     """
     Main function to scan a URL, prioritizing Google Safe Browsing,
     then falling back to VirusTotal for deeper analysis if GSB is safe.
+    Recently scanned URLs are answered from the verdict cache, and concurrent
+    requests for the same URL share a single scan.
+    """
+    key = _verdict_key(url)
+    message = _get_cached_verdict(key)
+    if message is not None:
+        return message
+
+    scan = _inflight_scans.get(key)
+    if scan is None:
+        scan = asyncio.create_task(_scan_url_limited(url, key))
+        _inflight_scans[key] = scan
+        scan.add_done_callback(lambda _: _inflight_scans.pop(key, None))
+    # Shielded so one caller giving up doesn't cancel the scan the others are waiting on
+    return await asyncio.shield(scan)
+
+async def _scan_url_limited(url: str, key: bytes) -> str:
+    """Runs an uncached scan within the overall concurrency and time limits and caches its verdict."""
+    global _scan_waiters
+    # Shed load instead of queuing without bound when every scan slot is taken
+    if _SCAN_SEM.locked() and _scan_waiters >= SCAN_MAX_WAITERS:
+        return SCAN_BUSY_MESSAGE
+
+    _scan_waiters += 1
+    try:
+        await _SCAN_SEM.acquire()
+    finally:
+        _scan_waiters -= 1
+    try:
+        verdict, message = await asyncio.wait_for(_scan_url_uncached(url), timeout=SCAN_DEADLINE)
+    except asyncio.TimeoutError:
+        print(f"Scan of {url} exceeded {SCAN_DEADLINE}s deadline.")
+        return SCAN_TIMEOUT_MESSAGE # Not cached so a retry scans again
+    finally:
+        _SCAN_SEM.release()
+    _store_verdict(key, verdict, message)
+    return message
+
+async def _scan_url_uncached(url: str) -> tuple[Verdict, str]:
+    """
+    Runs GSB and VirusTotal concurrently; VirusTotal is cancelled if GSB already settles the verdict.
     """
-    # 1. Attempt scan with Google Safe Browsing first
-    gsb_result = await scan_url_with_gsb(url)
+    # 1. Start both scans at once so a safe URL costs max(GSB, VT) instead of GSB + VT
+    gsb_task = asyncio.create_task(scan_url_with_gsb(url))
+    vt_task = asyncio.create_task(scan_url_with_virustotal(url))
+
+    try:
+        gsb_verdict, gsb_result = await gsb_task
+    except BaseException:
+        vt_task.cancel()
+        raise
 
     # If GSB found a malicious threat, return its verdict immediately
-    if "DANGER!" in gsb_result or "Error:" in gsb_result:
-        return gsb_result
+    if gsb_verdict == Verdict.DANGER:
+        vt_task.cancel() # VT's answer is no longer needed
+        return gsb_verdict, gsb_result
     
-    # If GSB reports it as safe, proceed to VirusTotal for deeper insights
-    elif "safe" in gsb_result.lower(): # Check if GSB explicitly said it's safe
-        vt_result = await scan_url_with_virustotal(url)
+    vt_verdict, vt_result = await vt_task
+    # If GSB reports it as safe, use VirusTotal for deeper insights
+    if gsb_verdict == Verdict.SAFE:
         # Combine GSB's initial safety verdict with VT's deeper analysis
         # For simplicity, if VT finds something, override GSB's "safe" with VT's warning.
         # If VT is also safe/inconclusive, append VT's message.
-        if "DANGER!" in vt_result or "WARNING!" in vt_result:
-            return vt_result # VT found something bad, so we prioritize its warning
+        if vt_verdict == Verdict.DANGER:
+            return vt_verdict, vt_result # VT found something bad, so we prioritize its warning
         else:
             # If GSB says safe AND VT says safe/inconclusive, combine for a more complete picture
-            return f"{gsb_result}\n\n--- VirusTotal Scan ---\n{vt_result}"
+            # (an unfinished or failed VT scan keeps the combined result from being cached long)
+            combined_verdict = vt_verdict if vt_verdict in (Verdict.ERROR, Verdict.PENDING) else Verdict.SAFE
+            return combined_verdict, f"{gsb_result}\n\n--- VirusTotal Scan ---\n{vt_result}"
     else:
-        # Fallback if GSB result is unexpected (e.g., neither DANGER nor safe, perhaps internal GSB error)
-        # In this case, just run VT scan.
-        return await scan_url_with_virustotal(url)
+        # Fallback if GSB couldn't scan (e.g. missing API key, quota or connection error)
+        # In this case, just use the VT scan.
+        return vt_verdict, vt_result
 
-async def scan_url_with_gsb(url: str) -> str:
+async def scan_url_with_gsb(url: str) -> tuple[Verdict, str]:
     """
     Scans a given URL using the Google Safe Browsing API.
+    Lookups arriving within a short window are sent to GSB together (see _gsb_batch_worker).
+    """
+    if not _GSB_URL_WITH_KEY:
+        return Verdict.ERROR, "❌ Error: Google Safe Browsing API key not configured. Cannot scan URL."
+
+    _ensure_gsb_worker()
+    future = asyncio.get_running_loop().create_future()
+    _gsb_queue.put_nowait((url, future))
+    return await future
+
+# --- GSB micro-batching ---
+# threatMatches:find accepts up to 500 URLs per request, so lookups arriving within a
+# short window are coalesced into one POST instead of one request per URL.
+GSB_BATCH_WINDOW = 0.03 # Seconds to wait for more URLs after the first one arrives
+GSB_MAX_BATCH_SIZE = 500
+_gsb_queue: asyncio.Queue | None = None
+_gsb_worker: asyncio.Task | None = None
+_gsb_batch_tasks: set[asyncio.Task] = set() # Keeps in-flight batch lookups referenced
+
+def _ensure_gsb_worker() -> None:
+    """Starts the GSB batching worker on the running event loop if it isn't running yet."""
+    global _gsb_queue, _gsb_worker
+    if _gsb_worker is None or _gsb_worker.done():
+        _gsb_queue = asyncio.Queue()
+        _gsb_worker = asyncio.create_task(_gsb_batch_worker())
+
+async def _gsb_batch_worker() -> None:
+    """Collects queued GSB lookups into batches and dispatches one request per batch."""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await _gsb_queue.get()]
+        batch_deadline = loop.time() + GSB_BATCH_WINDOW
+        while len(items) < GSB_MAX_BATCH_SIZE:
+            remaining = batch_deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(_gsb_queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        # Run the request separately so the next batch can be collected meanwhile
+        task = asyncio.create_task(_resolve_gsb_batch(items))
+        _gsb_batch_tasks.add(task)
+        task.add_done_callback(_gsb_batch_tasks.discard)
+
+async def _resolve_gsb_batch(items: list[tuple[str, asyncio.Future]]) -> None:
+    """Looks up a batch of URLs and hands each waiting caller its verdict."""
+    urls = list(dict.fromkeys(url for url, _ in items)) # Unique, in arrival order
+    try:
+        verdicts = await _gsb_lookup(urls)
+    except Exception as e:
+        verdicts = dict.fromkeys(urls, (Verdict.ERROR, f"❌ Unexpected error during GSB scan. (Details: `{e}`)"))
+    for url, future in items:
+        if not future.done(): # The caller may have been cancelled meanwhile
+            future.set_result(verdicts[url])
+
+def _canonicalize_for_gsb(url: str) -> str:
+    """Light GSB canonicalization: drops the fragment and lowercases scheme and host.
+
+    GSB expects the URL as-is rather than percent-encoded, so nothing else is changed.
     """
-    api_key = os.getenv("GOOGLE_SAFE_BROWSE_API_KEY")
-    if not api_key:
-        return "❌ Error: Google Safe Browsing API key not configured. Cannot scan URL."
+    url = url.split("#", 1)[0]
+    scheme_end = url.find("://")
+    if scheme_end == -1:
+        return url
+    host_start = scheme_end + 3
+    host_end = len(url)
+    for sep in "/?":
+        i = url.find(sep, host_start)
+        if i != -1:
+            host_end = min(host_end, i)
+    return url[:host_end].lower() + url[host_end:]
+
+async def _gsb_lookup(urls: list[str]) -> dict[str, tuple[Verdict, str]]:
+    """Sends one Safe Browsing request for the given URLs and returns a verdict per URL."""
+    if not _GSB_URL_WITH_KEY:
+        return dict.fromkeys(urls, (Verdict.ERROR, "❌ Error: Google Safe Browsing API key not configured. Cannot scan URL."))
 
+    canonical = {url: _canonicalize_for_gsb(url) for url in urls}
+    # Only the threat entries change per request; the rest comes from the shared template
     payload = {
-        "client": {
-            "clientId": "your-digital-safety-bot",
-            "clientVersion": "1.0.0"
-        },
+        **_GSB_PAYLOAD_TEMPLATE,
         "threatInfo": {
-            "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"],
-            "platformTypes": ["ANY_PLATFORM"],
-            "threatEntryTypes": ["URL"],
-            "threatEntries": [{"url": urllib.parse.quote(url, safe=':/')}]
+            **_GSB_PAYLOAD_TEMPLATE["threatInfo"],
+            "threatEntries": [{"url": c} for c in canonical.values()]
         }
     }
 
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{GOOGLE_SAFE_BROWSING_API_URL}?key={api_key}",
-                json=payload
+        response = await _CLIENT.post(
+            _GSB_URL_WITH_KEY,
+            content=orjson.dumps(payload),
+            headers=_JSON_HEADERS,
+            timeout=GSB_TIMEOUT
+        )
+        if response.status_code != 200:
+            if response.status_code == 400 and len(urls) > 1:
+                # One malformed URL rejects the whole batch; look the URLs up one by one instead
+                verdicts = {}
+                for url in urls:
+                    verdicts.update(await _gsb_lookup([url]))
+                return verdicts
+            message = _GSB_HTTP_ERRORS.get(response.status_code, _GSB_HTTP_ERROR_DEFAULT).format(
+                status=response.status_code, detail=response.text[:150]
             )
-            response.raise_for_status()
-            
-            result = response.json()
+            return dict.fromkeys(urls, (Verdict.ERROR, message))
+        
+        result = orjson.loads(response.content)
+
+        # Group matches by the URL they were reported for
+        threats: dict[str, set[str]] = {}
+        for m in result.get("matches", []):
+            threats.setdefault(m.get("threat", {}).get("url"), set()).add(m["threatType"])
 
-            if "matches" in result and len(result["matches"]) > 0:
-                threat_types = ", ".join(sorted(list(set(m["threatType"] for m in result["matches"]))))
-                return (
+        verdicts = {}
+        for url, c in canonical.items():
+            if c in threats:
+                threat_types = ", ".join(sorted(threats[c]))
+                verdicts[url] = Verdict.DANGER, (
                     f"🚨 **DANGER! This URL is highly malicious!** 🚨\n"
                     f"Detected as: **{threat_types.replace('_', ' ').title()}** by Google Safe Browsing."
                     f"\n\n🛑 **DO NOT CLICK THIS LINK!**"
                 )
             else:
-                return (
+                verdicts[url] = Verdict.SAFE, (
                     f"✅ This URL appears **safe** according to Google Safe Browsing.\n"
                     f"No known malware, phishing, or unwanted software detected."
                 )
-    except httpx.HTTPStatusError as e:
-        status_code = e.response.status_code
-        error_detail = e.response.text
-        if status_code == 400:
-            return f"❌ **Invalid URL for GSB!** Check the link format. (Details: `{error_detail}`)"
-        elif status_code == 403:
-            return f"❌ **Access Denied (Google Safe Browsing)!** Check your API key or daily quota. (Details: `{error_detail}`)"
-        elif status_code == 404:
-            return "❌ Error: Invalid API endpoint or URL. Check the Safe Browsing API configuration."
-        else:
-            return (
-                f"❌ An issue occurred with Google Safe Browsing scan (HTTP Error {status_code}). "
-                f"Please try again later. (Details: `{error_detail[:150]}`...)"
-            )
+        return verdicts
     except httpx.RequestError as e:
-        return f"❌ I couldn't connect to Google Safe Browsing. Check internet. (Error: `{e}`)"
+        message = f"❌ I couldn't connect to Google Safe Browsing. Check internet. (Error: `{e}`)"
     except Exception as e:
-        return f"❌ Unexpected error during GSB scan. (Details: `{e}`)"
+        message = f"❌ Unexpected error during GSB scan. (Details: `{e}`)"
+    return dict.fromkeys(urls, (Verdict.ERROR, message))
+
+async def _vt_submit(url: str) -> httpx.Response:
+    """Submits a URL to VT for analysis after a short head start for the existing-report lookup."""
+    await asyncio.sleep(VT_SUBMIT_DELAY)
+    return await _CLIENT.post(f"{VIRUSTOTAL_API_BASE_URL}/urls", headers=_VT_HEADERS, data={"url": url})
+
+def _discard_submit_result(task: asyncio.Task) -> None:
+    """Done-callback for speculative submits: a failure only matters if the submit is awaited."""
+    if not task.cancelled():
+        task.exception()
+
+async def _vt_fetch_or_submit(url: str, vt_url_id: str):
+    """
+    Fetches VT's existing report for a URL while speculatively submitting it for analysis.
+    The submit is cancelled when the existing report already has analysis stats
+    or fails outright. Returns (report_response, attributes, submit_response);
+    submit_response is None when the report response alone decides the outcome.
+    """
+    submit_task = asyncio.create_task(_vt_submit(url))
+    submit_task.add_done_callback(_discard_submit_result)
+    try:
+        report_response = await _CLIENT.get(f"{VIRUSTOTAL_API_BASE_URL}/urls/{vt_url_id}", headers=_VT_HEADERS)
+        if report_response.status_code == 200:
+            report_json = orjson.loads(report_response.content)
+            attributes = report_json.get("data", {}).get("attributes", {})
+            # A report without last_analysis_stats is just meta-info; fall back to the submit
+            if attributes.get("last_analysis_stats"):
+                submit_task.cancel()
+                return report_response, attributes, None
+        elif report_response.status_code != 404: # 404: no existing report, use the submit
+            submit_task.cancel()
+            return report_response, None, None
+    except BaseException:
+        submit_task.cancel()
+        raise
 
-async def scan_url_with_virustotal(url: str) -> str:
+    # Only now does a failed submit matter; its exception propagates to the caller
+    return report_response, None, await submit_task
+
+
+async def scan_url_with_virustotal(url: str) -> tuple[Verdict, str]:
     """
     Scans a given URL using the VirusTotal API.
     This function is called after GSB for deeper analysis if GSB finds no immediate threats.
     """
-    api_key = os.getenv("VIRUSTOTAL_API_KEY")
-    if not api_key:
+    if not _VT_API_KEY:
         print("VIRUSTOTAL_API_KEY not found in environment variables.")
-        return "❌ Error: VirusTotal API key not configured for secondary scan."
-
-    headers = {
-        "x-apikey": api_key,
-        "Accept": "application/json"
-    }
+        return Verdict.ERROR, "❌ Error: VirusTotal API key not configured for secondary scan."
 
     vt_url_id = get_vt_url_id(url)
     public_report_url = f"{VIRUSTOTAL_GUI_BASE_URL}{vt_url_id}/detection"
 
-    async with httpx.AsyncClient(timeout=45.0) as client:
-        try:
-            # Attempt 1: Check for existing URL report first in VT
-            existing_report_url = f"{VIRUSTOTAL_API_BASE_URL}/urls/{vt_url_id}"
-            report_response = await client.get(existing_report_url, headers=headers)
+    try:
+        # Check for an existing report while the submit for a new analysis gets ready
+        report_response, attributes, submit_response = await _vt_fetch_or_submit(url, vt_url_id)
+
+        if submit_response is None:
+            if attributes:
+                return await _process_vt_report_verdict(attributes, public_report_url)
+            return _vt_http_error(report_response)
+
+        # No completed report was found, so continue with the new analysis
+        if submit_response.status_code == 400:
+            submit_json = orjson.loads(submit_response.content)
+            error_code = submit_json.get("error", {}).get("code", "UNKNOWN_ERROR")
+            error_message = submit_json.get("error", {}).get("message", "Malformed URL or API error.")
+
+            if error_code == "InvalidArgumentError" and "canonicalize url" in error_message.lower():
+                return Verdict.ERROR, (
+                    f"❌ **Invalid URL Format for VT!**\n"
+                    f"VirusTotal couldn't process this. "
+                    f"([View details]({public_report_url}))"
+                )
+            elif error_code == "BadRequestError" and "Wrong URL id" in error_message:
+                # For common URLs that VT already knows deeply but doesn't re-submit easily.
+                # In this case, the existing report link is the best we can offer.
+                return Verdict.INCONCLUSIVE, (
+                    f"ℹ️ VirusTotal couldn't initiate a new scan for this common URL. "
+                    f"Please view its existing report: [View VT Report]({public_report_url})"
+                )
+            else:
+                return Verdict.ERROR, (
+                    f"❌ Issue submitting to VirusTotal: `{error_message}`. Try later."
+                )
+        elif not submit_response.is_success:
+            return _vt_http_error(submit_response)
+
+        submit_json = orjson.loads(submit_response.content)
+        analysis_id = submit_json.get("data", {}).get("id")
+
+        if not analysis_id:
+            return Verdict.ERROR, "⚠️ Could not initiate VT scan. No analysis ID. Try again."
+
+        # 3. Poll for the analysis report
+        analysis_report_url = f"{VIRUSTOTAL_API_BASE_URL}/analyses/{analysis_id}"
+
+        # Exponential backoff with jitter, bounded by a wall-clock deadline
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + VT_POLL_DEADLINE
+        delay = VT_POLL_INITIAL_DELAY
+        status = None
+        while True:
+            await asyncio.sleep(delay + random.uniform(0, VT_POLL_JITTER))
+
+            report_response = await _CLIENT.get(analysis_report_url, headers=_VT_HEADERS)
 
             if report_response.status_code == 200:
-                report_json = report_response.json()
+                report_json = orjson.loads(report_response.content)
+                if "error" in report_json:
+                    error_message = report_json["error"].get("message", "Unknown API error during report fetch.")
+                    return Verdict.ERROR, f"❌ Error fetching VT report: `{error_message}`. Try again."
+
                 attributes = report_json.get("data", {}).get("attributes", {})
-                
-                # Check if last_analysis_stats exists and contains results
-                if attributes.get("last_analysis_stats"):
+                status = attributes.get("status")
+
+                if status == "completed":
                     return await _process_vt_report_verdict(attributes, public_report_url)
-                else:
-                    # Report found but no analysis stats (e.g., just meta-info)
-                    pass # Fall through to submit a new scan
-            elif report_response.status_code == 404:
-                # No existing report, proceed to submit for analysis
-                pass
-            elif report_response.status_code == 401:
-                return "❌ **API Key Error (VT)!** Check your VirusTotal API key."
-            elif report_response.status_code == 403:
-                return "❌ **Access Denied (VT)!** VirusTotal quota exceeded."
-            else:
-                report_response.raise_for_status()
-
-            # Attempt 2: Submit for a new analysis if no completed report was found
-            submit_data = {"url": url}
-            submit_response = await client.post(f"{VIRUSTOTAL_API_BASE_URL}/urls", headers=headers, data=submit_data)
-
-            if submit_response.status_code == 400:
-                submit_json = submit_response.json()
-                error_code = submit_json.get("error", {}).get("code", "UNKNOWN_ERROR")
-                error_message = submit_json.get("error", {}).get("message", "Malformed URL or API error.")
-
-                if error_code == "InvalidArgumentError" and "canonicalize url" in error_message.lower():
-                    return (
-                        f"❌ **Invalid URL Format for VT!**\n"
-                        f"VirusTotal couldn't process this. "
-                        f"([View details]({public_report_url}))"
+                elif status != "queued" and status != "running":
+                    return Verdict.INCONCLUSIVE, (
+                        f"❓ VT report has unexpected status: `{status}`. "
+                        f"[View full report]({public_report_url})"
                     )
-                elif error_code == "BadRequestError" and "Wrong URL id" in error_message:
-                    # For common URLs that VT already knows deeply but doesn't re-submit easily.
-                    # In this case, the existing report link is the best we can offer.
-                    return (
-                        f"ℹ️ VirusTotal couldn't initiate a new scan for this common URL. "
-                        f"Please view its existing report: [View VT Report]({public_report_url})"
-                    )
-                else:
-                    return (
-                        f"❌ Issue submitting to VirusTotal: `{error_message}`. Try later."
-                    )
-            
-            submit_response.raise_for_status()
-
-            submit_json = submit_response.json()
-            analysis_id = submit_json.get("data", {}).get("id")
-
-            if not analysis_id:
-                return "⚠️ Could not initiate VT scan. No analysis ID. Try again."
-
-            # 3. Poll for the analysis report
-            analysis_report_url = f"{VIRUSTOTAL_API_BASE_URL}/analyses/{analysis_id}"
-
-            retries = 10
-            initial_delay = 5
-            for i in range(retries):
-                current_delay = initial_delay + (i * 2)
-                await asyncio.sleep(current_delay)
-
-                report_response = await client.get(analysis_report_url, headers=headers)
-
-                if report_response.status_code == 200:
-                    report_json = report_response.json()
-                    if "error" in report_json:
-                        error_message = report_json["error"].get("message", "Unknown API error during report fetch.")
-                        return f"❌ Error fetching VT report: `{error_message}`. Try again."
-
-                    attributes = report_json.get("data", {}).get("attributes", {})
-                    status = attributes.get("status")
-
-                    if status == "completed":
-                        return await _process_vt_report_verdict(attributes, public_report_url)
-                    elif status == "queued" or status == "running":
-                        if i == retries - 1:
-                            return (
-                                f"ℹ️ VT scan initiated. Report still processing ({status}). "
-                                f"View progress: [Scan Progress]({public_report_url})"
-                            )
-                        continue
-                    else:
-                        return (
-                            f"❓ VT report has unexpected status: `{status}`. "
-                            f"[View full report]({public_report_url})"
-                        )
-                elif report_response.status_code == 404:
-                    if i == retries - 1:
-                        return (
-                            f"ℹ️ VT scan initiated. Report still processing. "
-                            f"View progress: [Scan Progress]({public_report_url})"
-                        )
-                    continue
-                else:
-                    report_response.raise_for_status()
-
-            return (
-                f"ℹ️ VT scan timed out. Report might still be processing. "
-                f"Check later: [VirusTotal Report]({public_report_url})"
-            )
+            elif report_response.status_code != 404: # 404: analysis not available yet
+                return _vt_http_error(report_response)
 
-        except httpx.HTTPStatusError as e:
-            status_code = e.response.status_code
-            error_detail = e.response.text
-            return (
-                f"❌ VT scanning issue (HTTP Error {status_code}). Try again. "
-                f"(Details: `{error_detail[:150]}`...)"
-            )
-        except httpx.RequestError as e:
-            return f"❌ VT connection error. Check internet. (Error: `{e}`)"
-        except Exception as e:
-            return f"❌ Unexpected VT scan error. (Details: `{e}`)"
+            # Honor the server's Retry-After hint if it sends one
+            retry_after = _retry_after_seconds(report_response)
+            delay = retry_after if retry_after is not None else min(delay * VT_POLL_BACKOFF, VT_POLL_MAX_DELAY)
+            if loop.time() + delay >= deadline:
+                break
+
+        status_note = f" ({status})" if status else ""
+        return Verdict.PENDING, (
+            f"ℹ️ VT scan initiated. Report still processing{status_note}. "
+            f"View progress: [Scan Progress]({public_report_url})"
+        )
 
-async def _process_vt_report_verdict(attributes: dict, public_report_url: str) -> str:
+    except httpx.RequestError as e:
+        return Verdict.ERROR, f"❌ VT connection error. Check internet. (Error: `{e}`)"
+    except Exception as e:
+        return Verdict.ERROR, f"❌ Unexpected VT scan error. (Details: `{e}`)"
+
+async def _process_vt_report_verdict(attributes: dict, public_report_url: str) -> tuple[Verdict, str]:
     """Helper to parse VirusTotal results for the verdict."""
-    last_analysis_stats = attributes.get("last_analysis_stats", {})
-    malicious = last_analysis_stats.get("malicious", 0)
-    suspicious = last_analysis_stats.get("suspicious", 0)
-    harmless = last_analysis_stats.get("harmless", 0)
-    undetected = last_analysis_stats.get("undetected", 0)
-    
-    total_bad = malicious + suspicious
+    stats = attributes.get("last_analysis_stats") or {}
+    malicious = stats.get("malicious", 0)
+    suspicious = stats.get("suspicious", 0)
 
-    if total_bad > 0:
-        return (
+    if malicious + suspicious:
+        return Verdict.DANGER, (
             f"🚨 **DANGER! This URL is highly suspicious/malicious!** 🚨\n"
             f"VirusTotal detected **{malicious}** malicious and **{suspicious}** suspicious engines."
             f"\n\n🛑 **DO NOT CLICK THIS LINK!**"
             f"\n\n[View full report for more details]({public_report_url})"
         )
-    elif harmless > 0:
-        return (
+    # Only the non-danger branches need the remaining counts
+    harmless = stats.get("harmless", 0)
+    if harmless > 0:
+        return Verdict.SAFE, (
             f"✅ This URL appears **safe** based on VirusTotal scan.\n"
             f"Detected by **{harmless}** engines as harmless. No threats found."
             f"\n\n[View full report]({public_report_url})"
         )
     else:
         # This covers truly undetected, or cases where stats are all zero (unknown)
-        return (
+        undetected = stats.get("undetected", 0)
+        return Verdict.INCONCLUSIVE, (
             f"ℹ️ **VT Scan Inconclusive / No Threats Detected.** 🤔\n"
             f"VirusTotal did not detect immediate threats ({undetected} spaces reported undetected if applicable). "
             f"However, **exercise caution**, especially with new or unknown links. "